@@ -1,48 +1,288 @@
 import os
 import json
-from typing import List, Dict
+import sqlite3
+import hashlib
+import functools
+from typing import List, Dict, Optional
+import numpy as np
 from sentence_transformers import SentenceTransformer
 import chromadb
 from chromadb.config import Settings
+from chromadb.api.types import EmbeddingFunction
+
+# Optional: ONNX Runtime int8 backend for CPU embedding
+try:
+    from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoTokenizer
+except ImportError:
+    ORTModelForFeatureExtraction = None
+
+# Optional: FAISS compressed index for large collections
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+# Optional: Numba JIT for the rerank kernel; falls back to plain Python
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        return lambda fn: fn
+
+# HNSW tuning table: (collection size upper bound, params). Small corpora get a
+# lighter graph; larger ones trade build time for recall. construction_ef and
+# M are fixed when the collection is created; search_ef is applied per query
+# through n_results (hnswlib searches with ef = max(hnsw:search_ef, n_results)),
+# so it follows the collection's current size.
+HNSW_TUNING = [
+    (50_000, {"construction_ef": 64, "M": 16, "search_ef": 32}),
+    (float("inf"), {"construction_ef": 128, "M": 24, "search_ef": 100}),
+]
+# Stored hnsw:search_ef; kept small so n_results alone sets the search width
+HNSW_SEARCH_EF_FLOOR = 8
+
+# IVF + 48-byte product quantization once Chroma's HNSW graph outgrows
+# cache; below this size Chroma's own index is used
+FAISS_PQ_MIN_SIZE = 100_000
+FAISS_NPROBE = 16
+FAISS_RERANK_K = 20  # PQ candidates rescored with exact cosine per query
+
+def hnsw_params(collection_size: int = 0) -> Dict:
+    """HNSW params for the size bucket of a collection"""
+    return next(p for limit, p in HNSW_TUNING if collection_size < limit)
+
+def hnsw_metadata(collection_size: int = 0, overrides: Optional[Dict] = None) -> Dict:
+    """Build ChromaDB collection metadata with HNSW build params for the size bucket"""
+    params = {**hnsw_params(collection_size), "search_ef": HNSW_SEARCH_EF_FLOOR}
+    params.update(overrides or {})
+
+    metadata = {"hnsw:space": "cosine", "hnsw:num_threads": os.cpu_count() or 1}
+    metadata.update({f"hnsw:{key}": value for key, value in params.items()})
+    return metadata
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _ids_sha256(ids: List[str]) -> str:
+    return hashlib.sha256("\n".join(sorted(ids)).encode("utf-8")).hexdigest()
+
+@njit(cache=True, fastmath=True)
+def topk_cosine(query, mat, k):
+    """Indices and scores of the k rows of mat most cosine-similar to query"""
+    n, dim = mat.shape
+    query_norm = 0.0
+    for j in range(dim):
+        query_norm += query[j] * query[j]
+    query_norm = np.sqrt(query_norm)
+
+    scores = np.empty(n, dtype=np.float32)
+    for i in range(n):
+        dot = 0.0
+        row_norm = 0.0
+        for j in range(dim):
+            dot += mat[i, j] * query[j]
+            row_norm += mat[i, j] * mat[i, j]
+        scores[i] = dot / (np.sqrt(row_norm) * query_norm + 1e-12)
+
+    # Candidate sets are small, and numba has no np.argpartition
+    order = np.argsort(-scores)[:min(k, n)]
+    return order, scores[order]
+
+class EmbeddingCache:
+    """Persistent embedding cache keyed by (sha256(text), model id)"""
+    BATCH_SIZE = 500  # stay under SQLite's bound-variable limit
+
+    def __init__(self, db_path: str = "/home/unimate/chroma_db/embed_cache.sqlite"):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embedding_cache ("
+            "hash BLOB, model TEXT, vec BLOB, PRIMARY KEY (hash, model))"
+        )
+        self.conn.commit()
+
+    def get_many(self, hashes: List[bytes], model: str) -> Dict[bytes, List[float]]:
+        """Return cached vectors for the given hashes"""
+        found = {}
+        for s in range(0, len(hashes), self.BATCH_SIZE):
+            batch = hashes[s:s + self.BATCH_SIZE]
+            placeholders = ",".join("?" * len(batch))
+            rows = self.conn.execute(
+                f"SELECT hash, vec FROM embedding_cache WHERE model = ? AND hash IN ({placeholders})",
+                [model, *batch]
+            )
+            for h, vec in rows:
+                found[h] = np.frombuffer(vec, dtype=np.float32).tolist()
+        return found
+
+    def put_many(self, hashes: List[bytes], vectors: List[List[float]], model: str):
+        """Insert or replace vectors for the given hashes"""
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO embedding_cache (hash, model, vec) VALUES (?, ?, ?)",
+            [(h, model, np.asarray(v, dtype=np.float32).tobytes()) for h, v in zip(hashes, vectors)]
+        )
+        self.conn.commit()
+
+class OnnxSentenceEncoder:
+    """
+    Dynamically quantized int8 ONNX export of a sentence-transformers model.
+
+    Mirrors the parts of the SentenceTransformer API the indexer uses
+    (tokenizer, encode) so LocalEmbedder can swap backends transparently.
+    """
+    MAX_SEQ_LENGTH = 256  # all-MiniLM-L6-v2 max_seq_length
+
+    def __init__(self, model_name: str, cache_dir: str = "/home/unimate/onnx_models"):
+        repo_id = model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+        save_dir = os.path.join(cache_dir, repo_id.replace("/", "__"))
+        quantized_file = "model_quantized.onnx"
+
+        # Export and quantize once, then reuse the saved model
+        if not os.path.exists(os.path.join(save_dir, quantized_file)):
+            exported = ORTModelForFeatureExtraction.from_pretrained(
+                repo_id, export=True, provider="CPUExecutionProvider"
+            )
+            quantizer = ORTQuantizer.from_pretrained(exported)
+            quantizer.quantize(
+                save_dir=save_dir,
+                quantization_config=AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+            )
+            AutoTokenizer.from_pretrained(repo_id).save_pretrained(save_dir)
 
-class LocalEmbedder:
-    def __init__(self, model_name: str = "all-MiniLM-L6-v2"):
-        self.model = SentenceTransformer(model_name)
+        self.tokenizer = AutoTokenizer.from_pretrained(save_dir)
+        self.session = ORTModelForFeatureExtraction.from_pretrained(
+            save_dir, file_name=quantized_file, provider="CPUExecutionProvider"
+        )
 
-    def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        """Batch embed text chunks"""
-        return self.model.encode(texts, convert_to_tensor=False).tolist()
+    def encode(self, sentences, batch_size: int = 32, **kwargs) -> np.ndarray:
+        """
+        Mean-pooled, L2-normalized embeddings as a numpy array. Like
+        SentenceTransformer.encode, inputs are batched in length order so
+        each batch pads to a similar length.
+        """
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+
+        # Tokenize once unpadded, then pad each length-sorted batch
+        encoded = self.tokenizer(sentences, truncation=True, max_length=self.MAX_SEQ_LENGTH)
+        order = np.argsort([len(ids) for ids in encoded["input_ids"]], kind="stable")
+
+        embeddings = np.empty((len(sentences), self.session.config.hidden_size), dtype=np.float32)
+        for s in range(0, len(sentences), batch_size):
+            idx = order[s:s + batch_size]
+            inputs = self.tokenizer.pad(
+                {key: [values[i] for i in idx] for key, values in encoded.items()},
+                return_tensors="np"
+            )
+            hidden = self.session(**inputs).last_hidden_state
+            mask = inputs["attention_mask"][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            embeddings[idx] = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+        return embeddings[0] if single else embeddings
+
+@functools.lru_cache(maxsize=None)
+def _get_onnx_model(name: str) -> OnnxSentenceEncoder:
+    """Load each ONNX model once per process"""
+    return OnnxSentenceEncoder(name)
+
+@functools.lru_cache(maxsize=None)
+def _get_st_model(name: str) -> SentenceTransformer:
+    """Load each SentenceTransformer model once per process"""
+    # PyTorch fallback: make sure all cores are used
+    import torch
+    torch.set_num_threads(os.cpu_count() or 1)
+    return SentenceTransformer(name)
+
+class LocalEmbedder:
+    def __init__(self, model_name: str = "all-MiniLM-L6-v2", use_onnx: bool = True):
+        self.model_name = model_name
+        if use_onnx and ORTModelForFeatureExtraction is not None:
+            self.model = _get_onnx_model(model_name)
+            self.model_id = f"{model_name}:onnx-int8"
+        else:
+            self.model = _get_st_model(model_name)
+            self.model_id = model_name
+
+    def embed_documents(self, texts: List[str], batch_size: int = 64) -> List[List[float]]:
+        """Batch embed text chunks; both backends batch in length order"""
+        if not texts:
+            return []
+        return self.model.encode(texts, batch_size=batch_size, convert_to_numpy=True).tolist()
 
     def embed_query(self, text: str) -> List[float]:
         """Embed single query"""
         return self.model.encode(text, convert_to_tensor=False).tolist()
 
+class IndexerEmbeddingFunction(EmbeddingFunction):
+    """Lets ChromaDB embed documents itself through the indexer's embed path"""
+    def __init__(self, embed_fn):
+        self.embed_fn = embed_fn
+
+    def __call__(self, input: List[str]) -> List[List[float]]:
+        return self.embed_fn(list(input))
+
+DATA_DIR = "/home/unimate/unimate/data"
+
 class DocIndexer:
-    def __init__(self, data_dir: str = "/home/unimate/unimate/data"):
+    ADD_BATCH_SIZE = 512  # chunks per ChromaDB insert
+
+    def __init__(self, data_dir: str = DATA_DIR,
+                 expected_size: int = 0, hnsw_params: Optional[Dict] = None,
+                 embed_cache_path: str = "/home/unimate/chroma_db/embed_cache.sqlite",
+                 backup_embeddings: bool = False,
+                 faiss_index_path: str = "/home/unimate/chroma_db/doc_chunks.faiss"):
         self.embedder = LocalEmbedder()
+        self.embed_cache = EmbeddingCache(embed_cache_path)
+        self.embedding_function = IndexerEmbeddingFunction(self.embed_with_cache)
+        self.backup_embeddings = backup_embeddings
         self.data_dir = data_dir
         self.metadata_store = {}
 
         # Initialize ChromaDB
-        self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
         self.chroma_client = chromadb.PersistentClient(path="/home/unimate/chroma_db")
         #self.collection = self.chroma_client.get_or_create_collection(
         #   name="document_chunks",
         #    metadata={"hnsw:space": "cosine"}
         #)
 
-        # Get or create collection
-        self.collection = self.chroma_client.get_or_create_collection(
-            name="doc_chunks",
-            metadata={"hnsw:space": "cosine"}
-        )
+        # Get or create collection. HNSW params are fixed once the index is
+        # built, and chromadb 0.4.x get_or_create_collection would overwrite
+        # them on an existing collection, so only pass them on creation.
+        try:
+            self.collection = self.chroma_client.get_collection(
+                "doc_chunks", embedding_function=self.embedding_function
+            )
+        except Exception:
+            self.collection = self.chroma_client.create_collection(
+                name="doc_chunks",
+                metadata=hnsw_metadata(expected_size, hnsw_params),
+                embedding_function=self.embedding_function
+            )
+
+        # Load the FAISS index if one has been built; chunk text and metadata
+        # stay in ChromaDB and are fetched by id
+        self.faiss_index_path = faiss_index_path
+        self.faiss_index = None
+        self.faiss_ids = []
+        if faiss is not None and os.path.exists(faiss_index_path):
+            self._load_faiss_index()
 
         if not os.path.exists(data_dir):
             os.makedirs(data_dir)
 
-    def store_in_chromadb(self, doc_id: str, chunks: List[Dict], embeddings: List[List[float]]) -> Dict:
+    def store_in_chromadb(self, doc_id: str, chunks: List[Dict],
+                          embeddings: Optional[List[List[float]]] = None) -> Dict:
         """
-        Store chunks and embeddings in ChromaDB
+        Store chunks and embeddings in ChromaDB. Without precomputed
+        embeddings the collection's embedding function embeds the documents.
         """
         try:
             # Prepare data for ChromaDB
@@ -50,28 +290,25 @@ class DocIndexer:
             documents = [chunk["chunk_text"] for chunk in chunks]
 
             # PROPER METADATA CLEANING - NO None VALUES
-            metadatas = []
-            for i, chunk in enumerate(chunks):
-                # Get values with proper None handling
-                page = chunk.get("page_number")
-                heading = chunk.get("heading")
-
-                # Ensure no None values
-                metadata = {
-                    "doc_id": doc_id,
-                    "page": page if page is not None else 0,
-                    "heading": heading if heading is not None else "",
-                    "chunk_index": i
-                }
-                metadatas.append(metadata)
-
-            # Add to ChromaDB collection
-            self.collection.add(
-                ids=ids,
-                embeddings=embeddings,
-                documents=documents,
-                metadatas=metadatas
-            )
+            metadatas = [{
+                "doc_id": doc_id,
+                "page": chunk.get("page_number") or 0,
+                "heading": chunk.get("heading") or "",
+                "chunk_index": i
+            } for i, chunk in enumerate(chunks)]
+
+            # Add to ChromaDB collection in batches to bound memory per insert
+            for s in range(0, len(ids), self.ADD_BATCH_SIZE):
+                self.collection.add(
+                    ids=ids[s:s + self.ADD_BATCH_SIZE],
+                    embeddings=embeddings[s:s + self.ADD_BATCH_SIZE] if embeddings is not None else None,
+                    documents=documents[s:s + self.ADD_BATCH_SIZE],
+                    metadatas=metadatas[s:s + self.ADD_BATCH_SIZE]
+                )
+
+            # The FAISS index no longer covers the collection; fall back to
+            # ChromaDB search until build_faiss_index is run again
+            self.faiss_index = None
 
             return {
                 "status": "success",
@@ -105,14 +342,32 @@ class DocIndexer:
                 "error": str(e)
             }
 
+    def embed_with_cache(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts, only calling the model for cache misses"""
+        model = self.embedder.model_id
+        hashes = [hashlib.sha256(t.encode("utf-8")).digest() for t in texts]
+        cached = self.embed_cache.get_many(list(set(hashes)), model)
+
+        # Embed each distinct uncached text once
+        misses = {}
+        for h, text in zip(hashes, texts):
+            if h not in cached and h not in misses:
+                misses[h] = text
+        if misses:
+            fresh = self.embedder.embed_documents(list(misses.values()))
+            self.embed_cache.put_many(list(misses.keys()), fresh, model)
+            cached.update(zip(misses.keys(), fresh))
+
+        return [cached[h] for h in hashes]
+
     def process_and_store_chunks(self, doc_id: str, chunks: List[Dict]) -> Dict:
         """Process chunks, generate embeddings, and store in ChromaDB"""
         try:
-            # Extract texts for embedding
-            texts = [chunk["chunk_text"] for chunk in chunks]
-
-            # Generate embeddings
-            embeddings = self.embedder.embed_documents(texts)
+            # Without a backup, ChromaDB embeds the documents during insert
+            embeddings = None
+            if self.backup_embeddings:
+                # Generate embeddings, reusing cached vectors for unchanged text
+                embeddings = self.embed_with_cache([chunk["chunk_text"] for chunk in chunks])
 
             # Store in ChromaDB
             chroma_result = self.store_in_chromadb(doc_id, chunks, embeddings)
@@ -120,27 +375,31 @@ class DocIndexer:
             if chroma_result["status"] == "error":
                 raise Exception(f"ChromaDB storage failed: {chroma_result['error']}")
 
-            # Also save embeddings to JSON file for backup
-            output_path = os.path.join(self.data_dir, f"{doc_id}_embeddings.json")
-            with open(output_path, 'w') as f:
-                json.dump({
-                    "doc_id": doc_id,
-                    "embeddings": embeddings,
-                    "metadata": [{
-                        "page": chunk.get("page_number"),
-                        "heading": chunk.get("heading")
-                    } for chunk in chunks]
-                }, f, indent=2)
-
-            return {
+            result = {
                 "status": "success",
                 "doc_id": doc_id,
-                "embedding_file": output_path,
                 "chroma_result": chroma_result,
-                "chunk_count": len(chunks),
-                "sample_embedding": embeddings[0][:3]  # First 3 dimensions
+                "chunk_count": len(chunks)
             }
 
+            if embeddings is not None:
+                # Also save embeddings as a float16 .npy backup, metadata as JSON
+                output_path = os.path.join(self.data_dir, f"{doc_id}_embeddings.npy")
+                np.save(output_path, np.asarray(embeddings, dtype=np.float16))
+                with open(os.path.join(self.data_dir, f"{doc_id}_embeddings.json"), 'w') as f:
+                    json.dump({
+                        "doc_id": doc_id,
+                        "metadata": [{
+                            "page": chunk.get("page_number"),
+                            "heading": chunk.get("heading")
+                        } for chunk in chunks]
+                    }, f)
+
+                result["embedding_file"] = output_path
+                result["sample_embedding"] = embeddings[0][:3]  # First 3 dimensions
+
+            return result
+
         except Exception as e:
             return {
                 "status": "error",
@@ -148,17 +407,139 @@ class DocIndexer:
                 "error": str(e)
             }
 
+    def _collection_ids(self) -> List[str]:
+        """All chunk ids in the collection, paged"""
+        ids = []
+        for offset in range(0, self.collection.count(), self.ADD_BATCH_SIZE * 8):
+            ids.extend(self.collection.get(include=[], limit=self.ADD_BATCH_SIZE * 8, offset=offset)["ids"])
+        return ids
+
+    def _load_faiss_index(self):
+        """Load the FAISS index unless it is incomplete or no longer matches the collection"""
+        try:
+            with open(f"{self.faiss_index_path}.ids.json", 'r') as f:
+                sidecar = json.load(f)
+            index_ok = sidecar["index_sha256"] == _file_sha256(self.faiss_index_path)
+            # Any chunk added or deleted since the build changes the id set
+            ids_ok = sidecar["ids_sha256"] == _ids_sha256(self._collection_ids())
+        except Exception:
+            index_ok = ids_ok = False
+
+        if index_ok and ids_ok:
+            self.faiss_index = faiss.read_index(self.faiss_index_path)
+            self.faiss_ids = sidecar["ids"]
+        else:
+            print(f"FAISS index {self.faiss_index_path} is stale; using ChromaDB search until rebuilt")
+
+    def build_faiss_index(self, train_fraction: float = 0.2) -> Dict:
+        """
+        Build and persist a FAISS index over all vectors in the collection.
+
+        Uses IVF256,PQ48 (~48 bytes/vector) and is only built from
+        FAISS_PQ_MIN_SIZE chunks up; smaller collections are served by
+        Chroma's HNSW index. Vectors are L2-normalized so inner product
+        equals cosine similarity.
+        """
+        if faiss is None:
+            return {"status": "error", "error": "faiss is not installed"}
+
+        total = self.collection.count()
+        if total < FAISS_PQ_MIN_SIZE:
+            return {
+                "status": "skipped",
+                "reason": f"{total} chunks is below the IVF-PQ threshold of {FAISS_PQ_MIN_SIZE}"
+            }
+
+        try:
+            ids, vectors = [], []
+            for offset in range(0, total, self.ADD_BATCH_SIZE * 8):
+                page = self.collection.get(include=["embeddings"], limit=self.ADD_BATCH_SIZE * 8, offset=offset)
+                ids.extend(page["ids"])
+                vectors.append(np.asarray(page["embeddings"], dtype=np.float32))
+
+            vectors = np.ascontiguousarray(np.concatenate(vectors))
+            faiss.normalize_L2(vectors)
+
+            index = faiss.index_factory(vectors.shape[1], "IVF256,PQ48", faiss.METRIC_INNER_PRODUCT)
+            sample = np.random.default_rng(0).choice(
+                len(vectors), int(len(vectors) * train_fraction), replace=False
+            )
+            index.train(vectors[sample])
+            index.nprobe = FAISS_NPROBE
+            index.add(vectors)
+
+            # Write both files to temp paths and rename; the sidecar records
+            # the index checksum so a half-finished write reads as stale
+            sidecar_path = f"{self.faiss_index_path}.ids.json"
+            faiss.write_index(index, f"{self.faiss_index_path}.tmp")
+            with open(f"{sidecar_path}.tmp", 'w') as f:
+                json.dump({
+                    "index_sha256": _file_sha256(f"{self.faiss_index_path}.tmp"),
+                    "ids_sha256": _ids_sha256(ids),
+                    "ids": ids
+                }, f)
+            os.replace(f"{self.faiss_index_path}.tmp", self.faiss_index_path)
+            os.replace(f"{sidecar_path}.tmp", sidecar_path)
+
+            self.faiss_index, self.faiss_ids = index, ids
+            return {
+                "status": "success",
+                "index_file": self.faiss_index_path,
+                "vector_count": len(ids)
+            }
+
+        except Exception as e:
+            return {
+                "status": "error",
+                "error": str(e)
+            }
+
+    def _query_faiss(self, query_embedding: List[float], n_results: int) -> Dict:
+        """
+        Search the FAISS index and return results shaped like collection.query.
+        PQ scores are approximate, so the candidates are rescored with exact
+        cosine similarity on the full vectors stored in ChromaDB.
+        """
+        query = np.asarray([query_embedding], dtype=np.float32)
+        faiss.normalize_L2(query)
+        _, positions = self.faiss_index.search(query, max(n_results, FAISS_RERANK_K))
+
+        candidate_ids = [self.faiss_ids[p] for p in positions[0] if p != -1]
+        if not candidate_ids:
+            return {"ids": [[]], "distances": [[]], "documents": [[]], "metadatas": [[]]}
+        found = self.collection.get(ids=candidate_ids, include=["embeddings", "documents", "metadatas"])
+
+        order, scores = topk_cosine(
+            np.ascontiguousarray(query[0]),
+            np.ascontiguousarray(found["embeddings"], dtype=np.float32),
+            n_results
+        )
+        return {
+            "ids": [[found["ids"][i] for i in order]],
+            "distances": [[1.0 - float(score) for score in scores]],  # cosine distance
+            "documents": [[found["documents"][i] for i in order]],
+            "metadatas": [[found["metadatas"][i] for i in order]]
+        }
+
     def query_chromadb(self, query_text: str, n_results: int = 3) -> Dict:
-        """Query ChromaDB for similar chunks"""
+        """Query ChromaDB (or the FAISS index when built) for similar chunks"""
         try:
             # Embed the query
             query_embedding = self.embedder.embed_query(query_text)
 
-            # Search in ChromaDB
-            results = self.collection.query(
-                query_embeddings=[query_embedding],
-                n_results=n_results
-            )
+            if self.faiss_index is not None:
+                results = self._query_faiss(query_embedding, n_results)
+            else:
+                # Search in ChromaDB; asking for more results sets the HNSW
+                # search width to the tuned search_ef for the current size
+                width = max(n_results, hnsw_params(self.collection.count())["search_ef"])
+                results = self.collection.query(
+                    query_embeddings=[query_embedding],
+                    n_results=width
+                )
+                for key in ("ids", "distances", "documents", "metadatas"):
+                    if results.get(key) is not None:
+                        results[key] = [results[key][0][:n_results]]
 
             return {
                 "status": "success",
@@ -173,15 +554,34 @@ class DocIndexer:
             }
 
 if __name__ == "__main__":
-    # Initialize with your data directory
-    indexer = DocIndexer()
-
-    # Process all JSON files in the data directory
-    for filename in os.listdir(indexer.data_dir):
+    # Load all JSON files in the data directory first, so a new collection
+    # is created with HNSW params sized for what is about to be indexed
+    documents = {}
+    for filename in os.listdir(DATA_DIR):
         if filename.endswith(".json") and not filename.endswith("_embeddings.json"):
-            print(f"\n📄 Processing {filename}...")
-            result = indexer.process_file(filename)
-            print(json.dumps(result, indent=2))
+            with open(os.path.join(DATA_DIR, filename), 'r') as f:
+                documents[filename] = json.load(f)
+
+    indexer = DocIndexer(expected_size=sum(
+        len(chunks) for chunks in documents.values() if isinstance(chunks, list)
+    ))
+
+    for filename, chunks in documents.items():
+        print(f"\n📄 Processing {filename}...")
+        if isinstance(chunks, list):
+            result = indexer.process_and_store_chunks(filename, chunks)
+        else:
+            result = {
+                "status": "error",
+                "filename": filename,
+                "error": "Invalid format: Expected list of chunks"
+            }
+        print(json.dumps(result, indent=2))
+
+    # Rebuild the compressed index over the updated collection
+    if faiss is not None:
+        print(f"\n🧮 Building FAISS index...")
+        print(json.dumps(indexer.build_faiss_index(), indent=2))
 
     # Example query after processing
     print(f"\n🔍 Testing ChromaDB query...")
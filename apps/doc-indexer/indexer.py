@@ -1,42 +1,100 @@
 import os
-import pdfplumber
+import fitz  # PyMuPDF
 import json
-from typing import List, Dict, Optional
+import itertools
+import functools
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Optional, Tuple
 import re
+from transformers import AutoTokenizer
 
 # Configuration
 DATA_FOLDER = "/home/unimate/unimate/data"
-CHUNK_SIZE = 1000  # characters
-HEADING_PATTERN = r"^(#+|\b(?:Chapter|Section)\b|\d+\.\d+)\s+(.+)$"
+TOKENIZER_NAME = "sentence-transformers/all-MiniLM-L6-v2"  # same tokenizer as the embedder
+CHUNK_TOKENS = 254  # tokens per chunk: MiniLM max_seq_length 256 minus [CLS] and [SEP]
+CHUNK_OVERLAP = 32  # tokens shared between consecutive chunks
+HEADING_PATTERN = r"^(#+|(?:Chapter|Section)|[0-9]+\.[0-9]+) (.+)$"
+MAX_WORKERS = min(os.cpu_count() or 1, 6)
+
+# Prefer RE2's linear-time matcher when available. RE2's \s, \d and \b are
+# ASCII-only while re's are Unicode, so the pattern avoids them and
+# extract_heading normalises whitespace (PDF text often has NBSP) first.
+try:
+    import re2 as _regex
+except ImportError:
+    _regex = re
+_HEADING_RE = _regex.compile(f"(?i){HEADING_PATTERN}")
 
 def extract_heading(text: str) -> Optional[str]:
-    """Extracts heading from text if matches pattern"""
-    match = re.search(HEADING_PATTERN, text.strip(), re.IGNORECASE)
+    """Extracts heading from the first line of text if it matches pattern"""
+    lines = text.strip().splitlines()
+    if not lines:
+        return None
+    match = _HEADING_RE.match(" ".join(lines[0].split()))
     return match.group(2) if match else None
 
-def process_pdf(file_path: str) -> List[Dict]:
+@functools.lru_cache(maxsize=None)
+def _get_tokenizer():
+    """Load the chunking tokenizer once per process"""
+    return AutoTokenizer.from_pretrained(TOKENIZER_NAME)
+
+def split_into_chunks(text: str) -> List[str]:
+    """Split text into overlapping token windows, sliced from the original text"""
+    offsets = _get_tokenizer()(
+        text, add_special_tokens=False, return_offsets_mapping=True, verbose=False
+    )["offset_mapping"]
+    if not offsets:
+        return []
+
+    chunks = []
+    step = CHUNK_TOKENS - CHUNK_OVERLAP
+    for start in range(0, len(offsets), step):
+        window = offsets[start:start + CHUNK_TOKENS]
+        chunks.append(text[window[0][0]:window[-1][1]])
+        if start + CHUNK_TOKENS >= len(offsets):
+            break
+    return chunks
+
+def _extract_pages(file_path: str, start: int, stop: int) -> List[Tuple[int, str]]:
+    """Extract text from pages [start, stop) of a PDF; runs in a worker process"""
+    with fitz.open(file_path) as doc:
+        return [(page_num + 1, doc[page_num].get_text("text"))
+                for page_num in range(start, stop)]
+
+def process_pdf(file_path: str, max_workers: int = MAX_WORKERS) -> List[Dict]:
     """Process a single PDF file into chunks with metadata"""
     chunks = []
     try:
-        with pdfplumber.open(file_path) as pdf:
-            for page_num, page in enumerate(pdf.pages, start=1):
-                text = page.extract_text()
-                if not text:
-                    continue
-
-                # Extract potential heading from first lines
-                first_lines = "\n".join(text.split("\n")[:3])
-                heading = extract_heading(first_lines)
-
-                # Split into chunks
-                for i in range(0, len(text), CHUNK_SIZE):
-                    chunk = text[i:i+CHUNK_SIZE]
-                    chunks.append({
-                        "doc_id": os.path.basename(file_path),
-                        "chunk_text": chunk,
-                        "page_number": page_num,
-                        "heading": heading if i == 0 else None
-                    })
+        with fitz.open(file_path) as doc:
+            page_count = doc.page_count
+
+        # Extract page ranges in parallel; two ranges per worker keeps them balanced
+        if max_workers > 1 and page_count > 1:
+            step = max(1, -(-page_count // (max_workers * 2)))
+            starts = range(0, page_count, step)
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                ranges = executor.map(_extract_pages, [file_path] * len(starts), starts,
+                                      [min(start + step, page_count) for start in starts])
+                pages = [page for page_range in ranges for page in page_range]
+        else:
+            pages = _extract_pages(file_path, 0, page_count)
+
+        for page_num, text in pages:
+            if not text:
+                continue
+
+            # Extract potential heading from first lines
+            first_lines = "\n".join(itertools.islice(text.splitlines(), 3))
+            heading = extract_heading(first_lines)
+
+            # Split into token-window chunks
+            for i, chunk in enumerate(split_into_chunks(text)):
+                chunks.append({
+                    "doc_id": os.path.basename(file_path),
+                    "chunk_text": chunk,
+                    "page_number": page_num,
+                    "heading": heading if i == 0 else None
+                })
     except Exception as e:
         print(f"Error processing {file_path}: {str(e)}")
 
@@ -60,10 +118,16 @@ def process_all_pdfs():
         print(f"No PDF files found in '{DATA_FOLDER}'")
         return []
 
+    # Run PDFs in parallel and split the remaining cores across their pages
+    file_workers = min(MAX_WORKERS, len(pdf_files))
+    page_workers = max(1, MAX_WORKERS // file_workers)
+    file_paths = [os.path.join(DATA_FOLDER, f) for f in pdf_files]
+
     all_results = []
-    for pdf_file in pdf_files:
-        file_path = os.path.join(DATA_FOLDER, pdf_file)
-        chunks = process_pdf(file_path)
+    with ProcessPoolExecutor(max_workers=file_workers) as executor:
+        results = list(executor.map(process_pdf, file_paths, [page_workers] * len(file_paths)))
+
+    for pdf_file, chunks in zip(pdf_files, results):
         if chunks:
             save_to_json(chunks, pdf_file)
             all_results.append({
@@ -1,13 +1,131 @@
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+import os
+import json
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import time
+import functools
+import threading
+import hashlib
+from collections import OrderedDict
+import numpy as np
+import requests
 from langchain_community.llms import Ollama
 from langchain_community.vectorstores import Chroma
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain.chains import RetrievalQA
 from langchain.prompts import PromptTemplate
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 import uvicorn
-from typing import Optional
+from typing import Any, List, Optional
+
+# Blocking retrieval work (embedding + ChromaDB) runs here, off the event loop
+_POOL = ThreadPoolExecutor(max_workers=8)
+
+@functools.lru_cache(maxsize=None)
+def _get_hf_embeddings(model_name: str) -> HuggingFaceEmbeddings:
+    """Load each embedding model once per process"""
+    return HuggingFaceEmbeddings(model_name=model_name)
+
+class CachedQueryEmbeddings(Embeddings):
+    """Wraps an embedding model with a bounded LRU cache for query vectors"""
+    def __init__(self, embeddings: Embeddings, maxsize: int = 1024):
+        self.embeddings = embeddings
+        self.maxsize = maxsize
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        key = hashlib.sha1(text.encode("utf-8")).digest()
+        with self._lock:
+            vector = self._cache.get(key)
+            if vector is not None:
+                self._cache.move_to_end(key)
+                return vector.tolist()
+
+        vector = np.asarray(self.embeddings.embed_query(text), dtype=np.float32)
+        with self._lock:
+            self._cache[key] = vector
+            if len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return vector.tolist()
+
+class AdaptiveEfRetriever(BaseRetriever):
+    """
+    Retriever that widens the HNSW beam per query.
+
+    hnswlib searches with ef = max(hnsw:search_ef, n_results), so probes at or
+    below the collection's stored search_ef are all the same search. Start at
+    max(2*k, search_ef) and double until the k-th best distance stops
+    improving, the time budget is spent or ef_max is reached. The indexer
+    stores a small search_ef, so easy queries stay cheap and hard ones get
+    recall.
+    """
+    vectorstore: Any
+    k: int = 3
+    ef_max: int = 256
+    budget_ms: float = 50.0
+    tolerance: float = 1e-4
+    count_ttl_s: float = 60.0  # how long a cached collection count is trusted
+    collection_stats: dict = {}
+
+    def _collection_stats(self, collection):
+        """Collection size and stored search_ef, refreshed every count_ttl_s"""
+        stats = self.collection_stats
+        if time.time() - stats.get("checked_at", 0.0) > self.count_ttl_s:
+            stats["size"] = collection.count()
+            stats["search_ef"] = (collection.metadata or {}).get("hnsw:search_ef", 10)  # Chroma default
+            stats["checked_at"] = time.time()
+        return stats["size"], stats["search_ef"]
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
+        collection = self.vectorstore._collection
+        query_embedding = self.vectorstore._embedding_function.embed_query(query)
+        size, search_ef = self._collection_stats(collection)
+        if size == 0:
+            return []
+
+        start_time = time.time()
+        ef = min(max(2 * self.k, search_ef), size)
+        best_distance = None
+        while True:
+            # Only distances while probing; ids come back regardless
+            results = collection.query(
+                query_embeddings=[query_embedding],
+                n_results=ef,
+                include=["distances"]
+            )
+            distances = results["distances"][0][:self.k]
+            kth_distance = distances[-1] if distances else None
+
+            elapsed_ms = (time.time() - start_time) * 1000
+            converged = (best_distance is not None and kth_distance is not None
+                         and kth_distance >= best_distance - self.tolerance)
+            if converged or ef >= min(self.ef_max, size) or elapsed_ms >= self.budget_ms:
+                break
+            best_distance = kth_distance
+            ef = min(ef * 2, self.ef_max, size)
+
+        # Load text and metadata for the final top-k only
+        top_ids = results["ids"][0][:self.k]
+        found = collection.get(ids=top_ids, include=["documents", "metadatas"])
+        by_id = dict(zip(found["ids"], zip(found["documents"], found["metadatas"])))
+        return [
+            Document(page_content=by_id[chunk_id][0], metadata=by_id[chunk_id][1] or {})
+            for chunk_id in top_ids if chunk_id in by_id
+        ]
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
+        return await asyncio.get_running_loop().run_in_executor(
+            _POOL, functools.partial(self._get_relevant_documents, query)
+        )
 
 app = FastAPI(title="RAG Q&A API", version="1.0.0")
 
@@ -27,85 +145,162 @@ class ErrorResponse(BaseModel):
     status: str = "error"
 
 class SimpleRAGQA:
-    def __init__(self, chroma_db_path: str = "/home/unimate/chroma_db"):
+    KEEP_ALIVE = "24h"  # how long Ollama keeps mistral loaded after a call
+
+    PROMPT = PromptTemplate(
+        template="""Use the context to answer the question.
+
+            Context: {context}
+            Question: {question}
+            Answer clearly based on the context. If unsure, say you don't know.
+            Answer:""",
+        input_variables=["context", "question"]
+    )
+
+    def __init__(self, chroma_db_path: str = "/home/unimate/chroma_db",
+                 ollama_host: str = os.environ.get("OLLAMA_HOST", "http://ollama:11434")):
         print("🚀 Initializing RAG Q&A with Dockerized Ollama...")
 
         # 1. Initialize Local Embeddings
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name="all-MiniLM-L6-v2"
-        )
+        self.embeddings = CachedQueryEmbeddings(_get_hf_embeddings("all-MiniLM-L6-v2"))
 
-        # 2. Connect to ChromaDB
+        # 2. Connect to ChromaDB. The indexer creates the collection and owns
+        # its HNSW params, so it is opened without metadata here.
         self.vectorstore = Chroma(
             persist_directory=chroma_db_path,
             embedding_function=self.embeddings,
             collection_name="document_chunks"
         )
 
-        print("✅ RAG Q&A initialized! Ollama connection will be established per request.")
+        # 3. Retriever shared by the QA chains and the streaming path
+        self.retriever = AdaptiveEfRetriever(vectorstore=self.vectorstore, k=3)
 
-    def _create_qa_chain(self, ollama_host: str):
-        """Create RAG chain with specific Ollama host"""
+        # The LLM client and QA chain for the configured Ollama host are built
+        # once and reused; other hosts from request bodies are not cached
+        self.ollama_host = ollama_host
+        self._llm_cache = {}
+        self._chain_cache = {}
+        self._chain_lock = threading.RLock()
+
+        # 4. Load the model into Ollama now rather than on the first question
+        threading.Thread(target=self._warmup, args=(ollama_host,), daemon=True).start()
+
+        print("✅ RAG Q&A initialized! Ollama connection will be established on first request.")
+
+    def _warmup(self, ollama_host: str):
+        """Ask Ollama to load mistral and keep it resident"""
+        try:
+            requests.post(
+                f"{ollama_host}/api/generate",
+                json={
+                    "model": "mistral",
+                    "prompt": "warmup",
+                    "keep_alive": self.KEEP_ALIVE,
+                    "stream": False,
+                    "options": {"num_predict": 1}
+                },
+                timeout=300
+            ).raise_for_status()
+            print(f"🔥 Ollama model warmed up at {ollama_host}")
+        except Exception as e:
+            print(f"⚠️ Ollama warmup failed at {ollama_host}: {str(e)}")
+
+    def _create_llm(self, ollama_host: str):
+        """Create Ollama client for a specific host"""
         # Connect to Ollama running in Docker
-        llm = Ollama(
+        return Ollama(
             base_url=ollama_host,
             model="mistral",
             temperature=0.1,
             num_predict=512,
+            keep_alive=self.KEEP_ALIVE,
             timeout=300 #timout was 60, waiting more to 5min
         )
 
-        prompt_template = """Use the context to answer the question.
-
-            Context: {context}
-            Question: {question}
-            Answer clearly based on the context. If unsure, say you don't know.
-            Answer:"""
-
-        PROMPT = PromptTemplate(
-            template=prompt_template,
-            input_variables=["context", "question"]
-        )
-
+    def _create_qa_chain(self, ollama_host: str):
+        """Create RAG chain with specific Ollama host"""
         return RetrievalQA.from_chain_type(
-            llm=llm,
+            llm=self._get_llm(ollama_host),
             chain_type="stuff",
-            retriever=self.vectorstore.as_retriever(
-                search_type="similarity",
-                search_kwargs={"k": 3}
-            ),
-            chain_type_kwargs={"prompt": PROMPT},
+            retriever=self.retriever,
+            chain_type_kwargs={"prompt": self.PROMPT},
             return_source_documents=True
         )
 
-    def ask_question(self, question: str, ollama_host: str):
-        """Ask a single question and return answer with sources"""
-        start_time = time.time()
+    def _get_cached(self, cache: dict, ollama_host: str, factory):
+        """Return the cached object for the configured Ollama host, creating it once"""
+        if ollama_host != self.ollama_host:
+            # Hosts come from the request body; caching them all is unbounded
+            return factory(ollama_host)
 
-        try:
-            # Create chain with specific Ollama host for this request
-            qa_chain = self._create_qa_chain(ollama_host)
-            result = qa_chain({"query": question})
-
-            response = {
-                "question": question,
-                "answer": result["result"],
-                "sources": [
-                    {
-                        "document": doc.metadata.get("doc_id", "unknown"),
-                        "page": doc.metadata.get("page", 0),
-                        "content_preview": doc.page_content[:100] + "..." 
-                    }
-                    for doc in result["source_documents"]
-                ],
-                "processing_time": round(time.time() - start_time, 2)
+        value = cache.get(ollama_host)
+        if value is None:
+            with self._chain_lock:
+                value = cache.get(ollama_host)
+                if value is None:
+                    value = factory(ollama_host)
+                    cache[ollama_host] = value
+        return value
+
+    def _get_llm(self, ollama_host: str):
+        return self._get_cached(self._llm_cache, ollama_host, self._create_llm)
+
+    def _get_qa_chain(self, ollama_host: str):
+        return self._get_cached(self._chain_cache, ollama_host, self._create_qa_chain)
+
+    @staticmethod
+    def _format_sources(documents: List[Document]) -> list:
+        return [
+            {
+                "document": doc.metadata.get("doc_id", "unknown"),
+                "page": doc.metadata.get("page", 0),
+                "content_preview": doc.page_content[:100] + "..."
             }
+            for doc in documents
+        ]
+
+    async def aask_question(self, question: str, ollama_host: str):
+        """
+        Ask a single question and return answer with sources. No event-loop
+        or worker thread is held while Ollama generates.
+        """
+        start_time = time.time()
 
-            return response
+        try:
+            qa_chain = self._get_qa_chain(ollama_host)
+            result = await qa_chain.ainvoke({"query": question})
+            return self._build_response(question, result, start_time)
 
         except Exception as e:
             return {"error": f"Processing failed: {str(e)}"}
 
+    def _build_response(self, question: str, result: dict, start_time: float) -> dict:
+        return {
+            "question": question,
+            "answer": result["result"],
+            "sources": self._format_sources(result["source_documents"]),
+            "processing_time": round(time.time() - start_time, 2)
+        }
+
+    async def stream_question(self, question: str, ollama_host: str):
+        """
+        Yield a JSON line with the sources, then the answer tokens as Ollama
+        generates them. Retrieval finishes before the first token is sent.
+        """
+        try:
+            documents = await self.retriever.ainvoke(question)
+            yield json.dumps({"question": question, "sources": self._format_sources(documents)}) + "\n"
+
+            prompt = self.PROMPT.format(
+                context="\n\n".join(doc.page_content for doc in documents),
+                question=question
+            )
+            async for token in self._get_llm(ollama_host).astream(prompt):
+                yield token
+
+        except Exception as e:
+            yield json.dumps({"error": f"Processing failed: {str(e)}", "status": "error"}) + "\n"
+
 # Initialize RAG system once at startup
 rag_system = SimpleRAGQA()
 
@@ -118,7 +313,7 @@ async def ask_question(request: QuestionRequest):
     - **ollama_host**: Optional Ollama host URL (default: http://localhost:11434)
     """
     try:
-        result = rag_system.ask_question(request.question, request.ollama_host)
+        result = await rag_system.aask_question(request.question, request.ollama_host)
 
         if "error" in result:
             raise HTTPException(status_code=400, detail=result["error"])
@@ -128,6 +323,18 @@ async def ask_question(request: QuestionRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+@app.put("/ask/stream")
+async def ask_question_stream(request: QuestionRequest):
+    """
+    Ask a question and stream the answer as it is generated.
+
+    The first line is a JSON object with the sources; the answer text follows.
+    """
+    return StreamingResponse(
+        rag_system.stream_question(request.question, request.ollama_host),
+        media_type="text/plain"
+    )
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
@@ -140,6 +347,7 @@ async def root():
         "message": "RAG Q&A API",
         "endpoints": {
             "POST /ask": "Ask a question to the RAG system",
+            "PUT /ask/stream": "Ask a question and stream the answer",
             "GET /health": "Health check",
             "GET /": "API information"
         }